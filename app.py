@@ -8,6 +8,7 @@ from routes.auth import auth_router
 from routes.tests import tests_router
 from routes.test_execution import test_execution_router
 from routes.api_docs import api_docs_router
+from db import init_pool, close_pool, run_migrations
 from dotenv import load_dotenv
 import uuid
 from contextlib import asynccontextmanager
@@ -41,7 +42,20 @@ logger.addHandler(console_handler)
 
 ALLOWED_ORIGINS = os.getenv('ALLOWED_ORIGINS', 'http://localhost:3000').split(',')
 
-app = FastAPI(title="TestsFastApi", version="1.2.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Application starting up")
+    await init_pool()
+    try:
+        await run_migrations()
+    except Exception:
+        await close_pool()
+        raise
+    yield
+    await close_pool()
+    logger.info("Application shutting down")
+
+app = FastAPI(title="TestsFastApi", version="1.2.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -51,14 +65,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    logger.info("Application starting up")
-    yield
-    logger.info("Application shutting down")
-
-app.lifespan = lifespan
-
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     request_id = str(uuid.uuid4())
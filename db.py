@@ -1,7 +1,11 @@
 import aiomysql
+import orjson
 import logging
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from pymysql.constants import ER, FIELD_TYPE
+from pymysql.converters import decoders
 from utils import handle_db_error
 
 load_dotenv()
@@ -15,26 +19,139 @@ db_config = {
     'password': os.getenv('DB_PASSWORD'),
     'db': os.getenv('DB_NAME'),
     'charset': os.getenv('DB_CHARSET', 'utf8mb4'),
-    'cursorclass': aiomysql.DictCursor
+    'cursorclass': aiomysql.DictCursor,
+    # JSON columns (questions.options) come back as Python objects instead of raw strings
+    'conv': {**decoders, FIELD_TYPE.JSON: orjson.loads}
+}
+
+pool_config = {
+    'minsize': int(os.getenv('DB_POOL_MIN_SIZE', 20)),
+    'maxsize': int(os.getenv('DB_POOL_MAX_SIZE', 100)),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    'autocommit': False
 }
 
 pool = None
 
-async def get_db():
+async def init_pool():
+    global pool
+    try:
+        logger.info(f"Creating database connection pool: minsize={pool_config['minsize']}, maxsize={pool_config['maxsize']}")
+        pool = await aiomysql.create_pool(**pool_config, **db_config)
+    except Exception as e:
+        logger.error(f"Failed to create database pool: {str(e)}", exc_info=True)
+        raise
+
+async def close_pool():
     global pool
+    if pool:
+        pool.close()
+        await pool.wait_closed()
+        pool = None
+        logger.info("Database connection pool closed")
+
+@asynccontextmanager
+async def acquire_cursor():
     if pool is None:
+        logger.error("Database connection pool is not initialized")
+        raise RuntimeError("Database connection pool is not initialized")
+    if pool.freesize == 0 and pool.size >= pool.maxsize:
+        logger.warning(f"Database connection pool exhausted: size={pool.size}, maxsize={pool.maxsize}")
+    async with pool.acquire() as conn:
+        try:
+            async with conn.cursor() as cursor:
+                yield cursor
+        finally:
+            # The pool closes connections released mid-transaction, which with autocommit off
+            # includes every read-only request; end the transaction so the connection is reused.
+            if not conn.closed and conn.get_transaction_status():
+                try:
+                    await conn.rollback()
+                except aiomysql.Error as e:
+                    logger.warning(f"Failed to roll back released connection: {str(e)}")
+
+async def get_db():
+    async with acquire_cursor() as cursor:
+        yield cursor
+
+async def table_exists(cursor, table: str) -> bool:
+    await cursor.execute(
+        "SELECT 1 FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s LIMIT 1",
+        (table,)
+    )
+    return await cursor.fetchone() is not None
+
+async def index_exists(cursor, table: str, name: str) -> bool:
+    await cursor.execute(
+        "SELECT 1 FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1",
+        (table, name)
+    )
+    return await cursor.fetchone() is not None
+
+async def ensure_index(cursor, table: str, name: str, columns: str, unique: bool = False):
+    if not await index_exists(cursor, table, name):
+        logger.info(f"Creating index {name} on {table}")
+        try:
+            await cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})")
+        except aiomysql.OperationalError as e:
+            # Another worker created it between the check and the DDL
+            if e.args[0] != ER.DUP_KEYNAME:
+                raise
+            logger.info(f"Index {name} on {table} was created concurrently")
+
+async def ensure_column(cursor, table: str, name: str, definition: str) -> bool:
+    await cursor.execute(
+        "SELECT 1 FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s LIMIT 1",
+        (table, name)
+    )
+    if await cursor.fetchone():
+        return False
+    logger.info(f"Adding column {name} to {table}")
+    try:
+        await cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    except aiomysql.OperationalError as e:
+        # Another worker added it between the check and the DDL; that worker also runs any backfill
+        if e.args[0] != ER.DUP_FIELDNAME:
+            raise
+        logger.info(f"Column {name} on {table} was added concurrently")
+        return False
+    return True
+
+async def migrate_schema(cursor):
+    """Bring tables created by an older init_db up to the current schema. Safe to run repeatedly."""
+    if await ensure_column(cursor, 'tests', 'question_count', 'INT NOT NULL DEFAULT 0'):
+        await cursor.execute(
+            "UPDATE tests t SET question_count = (SELECT COUNT(*) FROM questions q WHERE q.test_id = t.id)"
+        )
+    # Existing questions all get position 0, so ORDER BY position, id keeps their insertion order
+    await ensure_column(cursor, 'questions', 'position', 'INT NOT NULL DEFAULT 0')
+    if not await index_exists(cursor, 'tests', 'uk_tests_title'):
+        # Test titles are only unique through this key, so refuse to run without it rather than
+        # silently accepting duplicates; existing duplicates have to be renamed by hand first.
+        await cursor.execute("SELECT title FROM tests GROUP BY title HAVING COUNT(*) > 1 LIMIT 10")
+        duplicates = [row['title'] for row in await cursor.fetchall()]
+        if duplicates:
+            raise RuntimeError(f"Cannot add unique key uk_tests_title, duplicate test titles exist: {duplicates}")
+        await ensure_index(cursor, 'tests', 'uk_tests_title', 'title', unique=True)
+    await ensure_index(cursor, 'test_attempts', 'idx_attempt_test_end', 'test_id, end_time, score, start_time')
+    await ensure_index(cursor, 'answers', 'idx_answer_question_cov', 'question_id, is_correct, answer_time')
+
+async def run_migrations():
+    async with acquire_cursor() as cursor:
+        if not await table_exists(cursor, 'tests'):
+            logger.warning("Database schema not found, run init_db() to create it")
+            return
         try:
-            logger.info("Creating database connection pool")
-            pool = await aiomysql.create_pool(**db_config)
+            await migrate_schema(cursor)
+            await cursor.connection.commit()
         except Exception as e:
-            logger.error(f"Failed to create database pool: {str(e)}", exc_info=True)
+            logger.error(f"Schema migration failed: {str(e)}", exc_info=True)
             raise
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            yield cursor
 
 async def init_db():
-    global pool
+    pool = None
     try:
         logger.info('Connecting to MySQL server')
         async with aiomysql.connect(
@@ -67,8 +184,10 @@ async def init_db():
                         creator_id INT NOT NULL,
                         time_limit INT,
                         shuffle_questions BOOLEAN DEFAULT FALSE,
+                        question_count INT NOT NULL DEFAULT 0,
                         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                         FOREIGN KEY (creator_id) REFERENCES users(id) ON DELETE CASCADE,
+                        UNIQUE KEY uk_tests_title (title),
                         INDEX idx_test_creator (creator_id)
                     )
                 """)
@@ -80,6 +199,7 @@ async def init_db():
                         type VARCHAR(20) NOT NULL,
                         options JSON,
                         correct_answer TEXT,
+                        position INT NOT NULL DEFAULT 0,
                         FOREIGN KEY (test_id) REFERENCES tests(id) ON DELETE CASCADE,
                         INDEX idx_question_test (test_id)
                     )
@@ -94,7 +214,8 @@ async def init_db():
                         end_time DATETIME,
                         FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
                         FOREIGN KEY (test_id) REFERENCES tests(id) ON DELETE CASCADE,
-                        INDEX idx_attempt_user_test (user_id, test_id)
+                        INDEX idx_attempt_user_test (user_id, test_id),
+                        INDEX idx_attempt_test_end (test_id, end_time, score, start_time)
                     )
                 """)
                 await cursor.execute("""
@@ -106,9 +227,11 @@ async def init_db():
                         is_correct BOOLEAN,
                         answer_time FLOAT,
                         FOREIGN KEY (attempt_id) REFERENCES test_attempts(id) ON DELETE CASCADE,
-                        FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE
+                        FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE,
+                        INDEX idx_answer_question_cov (question_id, is_correct, answer_time)
                     )
                 """)
+                await migrate_schema(cursor)
                 await conn.commit()
                 logger.info('Database initialized successfully')
     except Exception as e:
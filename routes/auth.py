@@ -6,20 +6,16 @@ import jwt
 import logging
 from db import get_db
 from utils import get_language, translate_message, handle_db_error
+from security import get_current_user, JWT_SECRET_KEY_BYTES
 from datetime import datetime, timedelta
 import os
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 
 load_dotenv()
-JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
 JWT_EXP_HOURS = int(os.getenv('JWT_EXP_HOURS', 24))
-if not JWT_SECRET_KEY:
-    raise ValueError("JWT_SECRET_KEY environment variable is not set")
 
 auth_router = APIRouter()
 logger = logging.getLogger('app.auth')
-security = HTTPBearer()
 
 class RegisterRequest(BaseModel):
     email: str
@@ -35,29 +31,11 @@ class UserResponse(BaseModel):
     email: str
     role: str
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), request: Request = None):
-    request_id = getattr(request.state, 'request_id', 'unknown')
-    logger.debug(f"Decoding JWT token: {credentials.credentials[:10]}...", extra={'request_id': request_id})
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET_KEY, algorithms=['HS256'])
-        user_id = payload['sub']
-        logger.info(f"Decoded JWT for user ID={user_id}", extra={'request_id': request_id})
-        return user_id
-    except jwt.ExpiredSignatureError:
-        logger.error(f"JWT token expired", extra={'request_id': request_id})
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError as e:
-        logger.error(f"Invalid JWT token: {str(e)}", extra={'request_id': request_id})
-        raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception as e:
-        logger.error(f"Unexpected error in JWT decoding: {str(e)}", extra={'request_id': request_id}, exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal server error")
-
 @auth_router.post("/register", summary="Register a new user")
 async def register(request: Request, data: RegisterRequest, cursor=Depends(get_db)):
     request_id = getattr(request.state, 'request_id', 'unknown')
     lang = get_language(request)
-    logger.debug(f"Register attempt: email={data.email}, role={data.role}", extra={'request_id': request_id})
+    logger.debug("Register attempt: email=%s, role=%s", data.email, data.role, extra={'request_id': request_id})
 
     async with cursor:
         try:
@@ -90,7 +68,7 @@ async def register(request: Request, data: RegisterRequest, cursor=Depends(get_d
 async def login(request: Request, data: LoginRequest, cursor=Depends(get_db)):
     request_id = getattr(request.state, 'request_id', 'unknown')
     lang = get_language(request)
-    logger.debug(f"Login attempt: email={data.email}", extra={'request_id': request_id})
+    logger.debug("Login attempt: email=%s", data.email, extra={'request_id': request_id})
 
     async with cursor:
         try:
@@ -102,7 +80,7 @@ async def login(request: Request, data: LoginRequest, cursor=Depends(get_db)):
 
             access_token = jwt.encode(
                 {'sub': user['id'], 'exp': int((datetime.now() + timedelta(hours=JWT_EXP_HOURS)).timestamp())},
-                JWT_SECRET_KEY, algorithm='HS256'
+                JWT_SECRET_KEY_BYTES, algorithm='HS256'
             )
             logger.info(f"User logged in: ID={user['id']}, Email={data.email}", extra={'request_id': request_id})
             return {'access_token': access_token}
@@ -116,7 +94,7 @@ async def login(request: Request, data: LoginRequest, cursor=Depends(get_db)):
 async def get_user_details(request: Request, user_id: int = Depends(get_current_user), cursor=Depends(get_db)):
     request_id = getattr(request.state, 'request_id', 'unknown')
     lang = get_language(request)
-    logger.debug(f"Fetching details for user ID={user_id}", extra={'request_id': request_id})
+    logger.debug("Fetching details for user ID=%s", user_id, extra={'request_id': request_id})
 
     async with cursor:
         try:
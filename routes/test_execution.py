@@ -1,33 +1,80 @@
 from fastapi import APIRouter, HTTPException, Request, Depends, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import aiomysql
-import json
-import random
-import datetime
+import csv
+import numpy as np
 import pandas as pd
-from io import BytesIO
+from io import BytesIO, StringIO
 import logging
 from db import get_db
+from schemas import AnswerSchema
 from utils import get_language, translate_message, handle_db_error, check_creator_permission, \
-    check_participant_permission
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import jwt
-import os
-from dotenv import load_dotenv
+    check_participant_permission, json_body, json_body_openapi
+from security import get_current_user
 from pandas.io.excel import ExcelWriter
 
-load_dotenv()
-JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
-if not JWT_SECRET_KEY:
-    raise ValueError("JWT_SECRET_KEY environment variable is not set")
-
 test_execution_router = APIRouter()
 logger = logging.getLogger('app.test_execution')
-security = HTTPBearer(auto_error=False)
+
+_SQL_SELECT_TEST_ID = "SELECT id FROM tests WHERE id = %s"
+_SQL_INSERT_ATTEMPT = "INSERT INTO test_attempts (user_id, test_id) VALUES (%s, %s)"
+_SQL_SELECT_SHUFFLE = "SELECT shuffle_questions FROM tests WHERE id = %s"
+_SQL_SELECT_QUESTIONS = "SELECT id, text, type, options FROM questions WHERE test_id = %s ORDER BY position, id"
+_SQL_SELECT_ACTIVE_ATTEMPT = "SELECT id FROM test_attempts WHERE user_id = %s AND test_id = %s AND end_time IS NULL"
+_SQL_SELECT_ANSWER_KEY = "SELECT id, correct_answer FROM questions WHERE test_id = %s"
+_SQL_INSERT_ANSWER = """
+    INSERT INTO answers (attempt_id, question_id, answer, is_correct, answer_time) 
+    VALUES (%s, %s, %s, %s, %s)
+"""
+_SQL_FINISH_ATTEMPT = """
+    UPDATE test_attempts 
+    SET score = %s, end_time = CURRENT_TIMESTAMP 
+    WHERE id = %s
+"""
+# Both stats queries are served from idx_attempt_test_end / idx_answer_question_cov (see db.py)
+_SQL_SELECT_ATTEMPT_AVERAGES = """
+    SELECT AVG(score) as avg_score, AVG(TIMESTAMPDIFF(SECOND, start_time, end_time)) as avg_time 
+    FROM test_attempts 
+    WHERE test_id = %s
+"""
+_SQL_SELECT_QUESTION_STATS = """
+    SELECT a.question_id, COUNT(*) as total, SUM(a.is_correct) as correct, AVG(a.answer_time) as avg_time 
+    FROM answers a 
+    JOIN questions q ON q.id = a.question_id 
+    WHERE q.test_id = %s 
+    GROUP BY a.question_id 
+    ORDER BY a.question_id
+"""
+# Filtered via idx_attempt_test_end (see db.py)
+_SQL_SELECT_ATTEMPTS_EXPORT = """
+    SELECT user_id, score, start_time, end_time, 
+    TIMESTAMPDIFF(SECOND, start_time, end_time) as completion_time 
+    FROM test_attempts 
+    WHERE test_id = %s
+"""
+
+
+_CSV_CHUNK_ROWS = 1000
+EXPORT_FORMATS = frozenset({'csv', 'json', 'excel'})
+
+
+def iter_csv(rows: list[dict]):
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if rows:
+        writer.writerow(rows[0].keys())
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row.values())
+        if i % _CSV_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
 
 
 class SubmitRequest(BaseModel):
-    answers: list[dict]
+    answers: list[AnswerSchema]
 
 
 class StatsResponse(BaseModel):
@@ -44,61 +91,43 @@ class TestResultResponse(BaseModel):
     score: float
 
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), request: Request = None):
-    request_id = request.state.request_id if request else 'unknown'
-    if not credentials or not credentials.credentials:
-        logger.error("Missing Authorization header", extra={'request_id': request_id})
-        raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
-
-    logger.debug(f"Decoding JWT token: {credentials.credentials[:10]}...", extra={'request_id': request_id})
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET_KEY, algorithms=['HS256'])
-        return payload['sub']
-    except jwt.ExpiredSignatureError:
-        logger.error(f"JWT expired", extra={'request_id': request_id})
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError as e:
-        logger.error(f"Invalid JWT: {str(e)}", extra={'request_id': request_id})
-        raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception as e:
-        logger.error(f"JWT decode error: {str(e)}", extra={'request_id': request_id}, exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal server error")
-
 @test_execution_router.post("/tests/{id}/start", summary="Start a test")
 async def start_test(id: int, request: Request, user_id: int = Depends(get_current_user), cursor=Depends(get_db)):
     request_id = request.state.request_id
     lang = get_language(request)
-    logger.debug(f"Starting test: test_id={id}, user_id={user_id}", extra={'request_id': request_id})
+    logger.debug("Starting test: test_id=%s, user_id=%s", id, user_id, extra={'request_id': request_id})
 
     async with cursor:
         try:
             await check_participant_permission(cursor, user_id, lang, request_id)
-            await cursor.execute("SELECT id FROM tests WHERE id = %s", (id,))
+            await cursor.execute(_SQL_SELECT_TEST_ID, (id,))
             if not await cursor.fetchone():
                 logger.warning(f"Test not found: test_id={id}", extra={'request_id': request_id})
                 raise HTTPException(status_code=404, detail=translate_message('test_not_found', lang))
 
-            await cursor.execute("INSERT INTO test_attempts (user_id, test_id) VALUES (%s, %s)", (user_id, id))
+            await cursor.execute(_SQL_INSERT_ATTEMPT, (user_id, id))
             attempt_id = cursor.lastrowid
 
-            await cursor.execute("SELECT shuffle_questions FROM tests WHERE id = %s", (id,))
+            await cursor.execute(_SQL_SELECT_SHUFFLE, (id,))
             shuffle = (await cursor.fetchone())['shuffle_questions']
 
-            await cursor.execute("SELECT id, text, type, options FROM questions WHERE test_id = %s", (id,))
+            await cursor.execute(_SQL_SELECT_QUESTIONS, (id,))
             questions = await cursor.fetchall()
-            if shuffle:
-                random.shuffle(questions)
-
-            for q in questions:
-                q['options'] = json.loads(q['options']) if q['options'] else None
+            order = np.random.permutation(len(questions)) if shuffle else range(len(questions))
 
             await cursor.connection.commit()
             logger.info(f"Test started: test_id={id}, attempt_id={attempt_id}, user_id={user_id}",
                         extra={'request_id': request_id})
             return {
                 'test_id': id,
-                'questions': [{'id': q['id'], 'text': q['text'], 'type': q['type'], 'options': q['options']} for q in
-                              questions]
+                'questions': [
+                    {
+                        'id': q['id'],
+                        'text': q['text'],
+                        'type': q['type'],
+                        'options': q['options']
+                    } for q in (questions[i] for i in order)
+                ]
             }
         except HTTPException:
             raise
@@ -109,12 +138,13 @@ async def start_test(id: int, request: Request, user_id: int = Depends(get_curre
             raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@test_execution_router.post("/tests/{id}/submit", summary="Submit test answers")
-async def submit_test(id: int, request: Request, data: SubmitRequest, user_id: int = Depends(get_current_user),
-                      cursor=Depends(get_db)):
+@test_execution_router.post("/tests/{id}/submit", summary="Submit test answers",
+                           openapi_extra=json_body_openapi(SubmitRequest))
+async def submit_test(id: int, request: Request, user_id: int = Depends(get_current_user),
+                      data: SubmitRequest = Depends(json_body(SubmitRequest)), cursor=Depends(get_db)):
     request_id = request.state.request_id
     lang = get_language(request)
-    logger.debug(f"Submitting test: test_id={id}, user_id={user_id}, answers_count={len(data.answers)}",
+    logger.debug("Submitting test: test_id=%s, user_id=%s, answers_count=%s", id, user_id, len(data.answers),
                  extra={'request_id': request_id})
 
     if not data.answers:
@@ -124,66 +154,42 @@ async def submit_test(id: int, request: Request, data: SubmitRequest, user_id: i
     async with cursor:
         try:
             await check_participant_permission(cursor, user_id, lang, request_id)
-            await cursor.execute("SELECT id FROM tests WHERE id = %s", (id,))
+            await cursor.execute(_SQL_SELECT_TEST_ID, (id,))
             test = await cursor.fetchone()
             if not test:
                 logger.warning(f"Test not found: test_id={id}", extra={'request_id': request_id})
                 raise HTTPException(status_code=404, detail=translate_message('test_not_found', lang))
 
-            await cursor.execute(
-                "SELECT id FROM test_attempts WHERE user_id = %s AND test_id = %s AND end_time IS NULL", (user_id, id))
+            await cursor.execute(_SQL_SELECT_ACTIVE_ATTEMPT, (user_id, id))
             attempt = await cursor.fetchone()
             if not attempt:
                 logger.warning(f"No active attempt found: test_id={id}, user_id={user_id}",
                                extra={'request_id': request_id})
                 raise HTTPException(status_code=403, detail=translate_message('no_permission', lang))
 
-            question_ids = [ans['question_id'] for ans in data.answers]
-            await cursor.execute("SELECT id FROM questions WHERE test_id = %s AND id IN %s",
-                                 (id, tuple(question_ids) if question_ids else (0,)))
-            valid_question_ids = {q['id'] for q in await cursor.fetchall()}
-            if set(question_ids) - valid_question_ids:
-                logger.warning(f"Invalid question IDs provided: {set(question_ids) - valid_question_ids}",
+            await cursor.execute(_SQL_SELECT_ANSWER_KEY, (id,))
+            qmap = {q['id']: q['correct_answer'] for q in await cursor.fetchall()}
+            total_questions = len(qmap)
+
+            invalid_question_ids = {ans.question_id for ans in data.answers} - qmap.keys()
+            if invalid_question_ids:
+                logger.warning(f"Invalid question IDs provided: {invalid_question_ids}",
                                extra={'request_id': request_id})
                 raise HTTPException(status_code=400, detail=translate_message('validation_error', lang))
 
-            await cursor.execute("SELECT COUNT(*) as count FROM questions WHERE test_id = %s", (id,))
-            total_questions = (await cursor.fetchone())['count']
-
-            score = 0
-            correct_answers = []
-            for ans in data.answers:
-                await cursor.execute("SELECT correct_answer, test_id FROM questions WHERE id = %s",
-                                     (ans['question_id'],))
-                question = await cursor.fetchone()
-                if not question or question['test_id'] != id:
-                    logger.warning(f"Invalid question: question_id={ans['question_id']}, test_id={id}",
-                                   extra={'request_id': request_id})
-                    raise HTTPException(status_code=400, detail=translate_message('validation_error', lang))
-
-                is_correct = (ans['answer'] == question['correct_answer'])
-                if is_correct:
-                    score += 1
-
-                await cursor.execute(
-                    """
-                    INSERT INTO answers (attempt_id, question_id, answer, is_correct, answer_time) 
-                    VALUES (%s, %s, %s, %s, %s)
-                    """,
-                    (attempt['id'], ans['question_id'], ans['answer'], is_correct, ans.get('answer_time', 0))
-                )
-                correct_answers.append(
-                    {'question_id': ans['question_id'], 'correct_answer': question['correct_answer']})
+            results = [ans.answer == qmap[ans.question_id] for ans in data.answers]
+            score = sum(results)
 
-            final_score = (score / total_questions) * 100 if total_questions > 0 else 0
-            await cursor.execute(
-                """
-                UPDATE test_attempts 
-                SET score = %s, end_time = %s 
-                WHERE id = %s
-                """,
-                (final_score, datetime.datetime.now(datetime.UTC), attempt['id'])
+            await cursor.executemany(
+                _SQL_INSERT_ANSWER,
+                [(attempt['id'], ans.question_id, ans.answer, is_correct, ans.answer_time or 0)
+                 for ans, is_correct in zip(data.answers, results)]
             )
+            correct_answers = [{'question_id': ans.question_id, 'correct_answer': qmap[ans.question_id]}
+                               for ans in data.answers]
+
+            final_score = (score / total_questions) * 100 if total_questions > 0 else 0
+            await cursor.execute(_SQL_FINISH_ATTEMPT, (final_score, attempt['id']))
             await cursor.connection.commit()
             logger.info(
                 f"Test submitted: test_id={id}, attempt_id={attempt['id']}, user_id={user_id}, score={final_score}",
@@ -202,9 +208,9 @@ async def submit_test(id: int, request: Request, data: SubmitRequest, user_id: i
 async def get_test_stats(id: int, request: Request, user_id: int = Depends(get_current_user), cursor=Depends(get_db)):
     request_id = request.state.request_id
     lang = get_language(request)
-    logger.debug(
-        f"Retrieving stats: test_id={id}, user_id={user_id}, method={request.method}, headers={dict(request.headers)}",
-        extra={'request_id': request_id})
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Retrieving stats: test_id=%s, user_id=%s, method=%s, headers=%s",
+                     id, user_id, request.method, dict(request.headers), extra={'request_id': request_id})
 
     async with cursor:
         try:
@@ -220,37 +226,18 @@ async def get_test_stats(id: int, request: Request, user_id: int = Depends(get_c
                 raise HTTPException(status_code=400, detail="GET requests must not include a body")
 
             await check_creator_permission(cursor, user_id, test_id=id, lang=lang, request_id=request_id)
-            await cursor.execute("SELECT AVG(score) as avg_score FROM test_attempts WHERE test_id = %s", (id,))
-            avg_score = (await cursor.fetchone())['avg_score'] or 0
-
-            await cursor.execute(
-                """
-                SELECT AVG(TIMESTAMPDIFF(SECOND, start_time, end_time)) as avg_time 
-                FROM test_attempts 
-                WHERE test_id = %s AND end_time IS NOT NULL
-                """,
-                (id,)
-            )
-            avg_completion_time = (await cursor.fetchone())['avg_time'] or 0
-
-            await cursor.execute("SELECT id FROM questions WHERE test_id = %s", (id,))
-            questions = await cursor.fetchall()
-            difficulty = {}
-            for q in questions:
-                await cursor.execute(
-                    """
-                    SELECT COUNT(*) as total, SUM(is_correct) as correct, AVG(answer_time) as avg_time 
-                    FROM answers 
-                    WHERE question_id = %s
-                    """,
-                    (q['id'],)
-                )
-                stats = await cursor.fetchone()
-                if stats['total'] > 0:
-                    difficulty[f"question_{q['id']}"] = {
-                        'correct_percentage': (stats['correct'] / stats['total']) * 100,
-                        'average_time': stats['avg_time'] or 0
-                    }
+            await cursor.execute(_SQL_SELECT_ATTEMPT_AVERAGES, (id,))
+            averages = await cursor.fetchone()
+            avg_score = averages['avg_score'] or 0
+            avg_completion_time = averages['avg_time'] or 0
+
+            await cursor.execute(_SQL_SELECT_QUESTION_STATS, (id,))
+            difficulty = {
+                f"question_{stats['question_id']}": {
+                    'correct_percentage': (stats['correct'] / stats['total']) * 100,
+                    'average_time': stats['avg_time'] or 0
+                } for stats in await cursor.fetchall()
+            }
 
             logger.info(
                 f"Stats retrieved: test_id={id}, avg_score={avg_score}, avg_completion_time={avg_completion_time}",
@@ -276,9 +263,9 @@ async def export_stats(id: int, request: Request, format: str = "csv", user_id:
                        cursor=Depends(get_db)):
     request_id = request.state.request_id
     lang = get_language(request)
-    logger.debug(f"Exporting stats: test_id={id}, user_id={user_id}, format={format}", extra={'request_id': request_id})
+    logger.debug("Exporting stats: test_id=%s, user_id=%s, format=%s", id, user_id, format, extra={'request_id': request_id})
 
-    if format not in ['csv', 'json', 'excel']:
+    if format not in EXPORT_FORMATS:
         logger.warning(f"Invalid format requested: {format}", extra={'request_id': request_id})
         raise HTTPException(status_code=400, detail=translate_message('validation_error', lang))
 
@@ -290,15 +277,7 @@ async def export_stats(id: int, request: Request, format: str = "csv", user_id:
                 raise HTTPException(status_code=422, detail=translate_message('validation_error', lang))
 
             await check_creator_permission(cursor, user_id, test_id=id, lang=lang, request_id=request_id)
-            await cursor.execute(
-                """
-                SELECT user_id, score, start_time, end_time, 
-                TIMESTAMPDIFF(SECOND, start_time, end_time) as completion_time 
-                FROM test_attempts 
-                WHERE test_id = %s
-                """,
-                (id,)
-            )
+            await cursor.execute(_SQL_SELECT_ATTEMPTS_EXPORT, (id,))
             attempts = await cursor.fetchall()
 
             data = [
@@ -327,9 +306,8 @@ async def export_stats(id: int, request: Request, format: str = "csv", user_id:
                     headers={"Content-Disposition": f"attachment; filename=test_{id}_stats.xlsx"}
                 )
             else:  # csv
-                df = pd.DataFrame(data)
-                return Response(
-                    content=df.to_csv(index=False),
+                return StreamingResponse(
+                    iter_csv(data),
                     media_type="text/csv",
                     headers={"Content-Disposition": f"attachment; filename=test_{id}_stats.csv"}
                 )
@@ -1,30 +1,64 @@
 from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 import aiomysql
-import json
+from pymysql.constants import ER
+import orjson
 import logging
 from db import get_db
-from utils import get_language, translate_message, handle_db_error, check_creator_permission
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import jwt
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
-if not JWT_SECRET_KEY:
-    raise ValueError("JWT_SECRET_KEY environment variable is not set")
+from schemas import QuestionSchema
+from utils import get_language, translate_message, handle_db_error, check_creator_permission, json_body, json_body_openapi
+from security import get_current_user
 
 tests_router = APIRouter()
 logger = logging.getLogger('app.tests')
-security = HTTPBearer()
+
+_SQL_SELECT_TESTS = "SELECT id, title, description, question_count FROM tests"
+_SQL_SELECT_TESTS_BY_CREATOR = "SELECT id, title, description, question_count FROM tests WHERE creator_id = %s"
+_SQL_SELECT_USER_RESULTS = """
+    SELECT ta.test_id, t.title as test_title, ta.start_time, ta.end_time, ta.score
+    FROM test_attempts ta
+    JOIN tests t ON ta.test_id = t.id
+    WHERE ta.user_id = %s AND ta.end_time IS NOT NULL
+    ORDER BY ta.end_time DESC
+"""
+_SQL_SELECT_TEST_WITH_QUESTIONS = """
+    SELECT t.id, t.title, t.description, t.time_limit, t.shuffle_questions,
+           q.id as question_id, q.text, q.type, q.options, q.correct_answer
+    FROM tests t
+    LEFT JOIN questions q ON q.test_id = t.id
+    WHERE t.id = %s
+    ORDER BY q.position, q.id
+"""
+_SQL_SELECT_QUESTIONS = "SELECT id, text, type, options, correct_answer, position FROM questions WHERE test_id = %s"
+_SQL_INSERT_TEST = (
+    "INSERT INTO tests (title, description, creator_id, time_limit, shuffle_questions, question_count) "
+    "VALUES (%s, %s, %s, %s, %s, %s)"
+)
+_SQL_UPDATE_TEST = (
+    "UPDATE tests SET title = %s, description = %s, time_limit = %s, shuffle_questions = %s, question_count = %s "
+    "WHERE id = %s"
+)
+_SQL_INSERT_QUESTION = (
+    "INSERT INTO questions (test_id, text, type, options, correct_answer, position) "
+    "VALUES (%s, %s, %s, %s, %s, %s)"
+)
+_SQL_UPSERT_QUESTION = (
+    "INSERT INTO questions (id, test_id, text, type, options, correct_answer, position) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE text = VALUES(text), type = VALUES(type), options = VALUES(options), "
+    "correct_answer = VALUES(correct_answer), position = VALUES(position)"
+)
+_SQL_DELETE_QUESTIONS_BY_ID = "DELETE FROM questions WHERE test_id = %s AND id IN %s"
+_SQL_DELETE_QUESTIONS = "DELETE FROM questions WHERE test_id = %s"
+_SQL_DELETE_TEST = "DELETE FROM tests WHERE id = %s"
 
 class TestRequest(BaseModel):
     title: str
     description: str | None = None
     time_limit: int | None = None
     shuffle_questions: bool = False
-    questions: list[dict]
+    questions: list[QuestionSchema]
 
 class TestResponse(BaseModel):
     id: int
@@ -50,81 +84,50 @@ class TestResultResponse(BaseModel):
     end_time: str
     score: float
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), request: Request = None):
-    request_id = request.state.request_id if request else 'unknown'
-    logger.debug(f"Decoding JWT token: {credentials.credentials[:10]}...", extra={'request_id': request_id})
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET_KEY, algorithms=['HS256'])
-        return payload['sub']
-    except jwt.ExpiredSignatureError:
-        logger.error(f"JWT token expired", extra={'request_id': request_id})
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError as e:
-        logger.error(f"Invalid JWT token: {str(e)}", extra={'request_id': request_id})
-        raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception as e:
-        logger.error(f"Unexpected error in JWT decoding: {str(e)}", extra={'request_id': request_id}, exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal server error")
+class TestResultListResponse(BaseModel):
+    results: list[TestResultResponse]
 
-@tests_router.get("/tests", summary="Retrieve list of tests", response_model=TestListResponse)
+def serialize_question_options(questions: list[QuestionSchema]) -> list[str | None]:
+    # Options are already validated as list[str] by QuestionSchema; empty lists are stored as NULL
+    return [orjson.dumps(q.options).decode() if q.options else None for q in questions]
+
+@tests_router.get("/tests", summary="Retrieve list of tests", response_class=ORJSONResponse,
+                  responses={200: {"model": TestListResponse}})
 async def get_tests(request: Request, cursor=Depends(get_db), user_id: int = Depends(get_current_user)):
     request_id = request.state.request_id
-    logger.debug(f"Fetching tests for user_id={user_id}", extra={'request_id': request_id})
+    logger.debug("Fetching tests for user_id=%s", user_id, extra={'request_id': request_id})
     async with cursor:
         try:
-            await cursor.execute("""
-                SELECT t.id, t.title, t.description, COUNT(q.id) as question_count
-                FROM tests t
-                LEFT JOIN questions q ON t.id = q.test_id
-                GROUP BY t.id, t.title, t.description
-            """)
-            tests = await cursor.fetchall()
+            # Unbuffered cursor: rows are decoded straight into the response list without a driver-side copy
+            async with cursor.connection.cursor(aiomysql.SSDictCursor) as stream:
+                await stream.execute(_SQL_SELECT_TESTS)
+                tests = [row async for row in stream]
             if not tests:
                 logger.info('No tests found', extra={'request_id': request_id})
-                return {"tests": []}
-            test_list = [
-                TestResponse(
-                    id=test['id'],
-                    title=test['title'],
-                    description=test['description'],
-                    question_count=test['question_count']
-                ) for test in tests
-            ]
-            logger.info(f"Retrieved {len(test_list)} tests for user_id={user_id}", extra={'request_id': request_id})
-            return {"tests": test_list}
+                return ORJSONResponse({"tests": []})
+            logger.info(f"Retrieved {len(tests)} tests for user_id={user_id}", extra={'request_id': request_id})
+            return ORJSONResponse({"tests": tests})
         except (aiomysql.OperationalError, aiomysql.IntegrityError) as e:
             raise await handle_db_error(e, request_id)
         except Exception as e:
             logger.error(f"Unexpected error retrieving tests: {str(e)}", extra={'request_id': request_id}, exc_info=True)
             raise HTTPException(status_code=500, detail="Internal server error")
 
-@tests_router.get("/tests/me", summary="Retrieve list of tests created by the current user", response_model=TestListResponse)
+@tests_router.get("/tests/me", summary="Retrieve list of tests created by the current user", response_class=ORJSONResponse,
+                  responses={200: {"model": TestListResponse}})
 async def get_my_tests(request: Request, cursor=Depends(get_db), user_id: int = Depends(get_current_user)):
     request_id = request.state.request_id
-    logger.debug(f"Fetching tests created by user_id={user_id}", extra={'request_id': request_id})
+    logger.debug("Fetching tests created by user_id=%s", user_id, extra={'request_id': request_id})
     async with cursor:
         try:
-            await cursor.execute("""
-                SELECT t.id, t.title, t.description, COUNT(q.id) as question_count
-                FROM tests t
-                LEFT JOIN questions q ON t.id = q.test_id
-                WHERE t.creator_id = %s
-                GROUP BY t.id, t.title, t.description
-            """, (user_id,))
-            tests = await cursor.fetchall()
+            async with cursor.connection.cursor(aiomysql.SSDictCursor) as stream:
+                await stream.execute(_SQL_SELECT_TESTS_BY_CREATOR, (user_id,))
+                tests = [row async for row in stream]
             if not tests:
                 logger.info(f"No tests found for user_id={user_id}", extra={'request_id': request_id})
-                return {"tests": []}
-            test_list = [
-                TestResponse(
-                    id=test['id'],
-                    title=test['title'],
-                    description=test['description'],
-                    question_count=test['question_count']
-                ) for test in tests
-            ]
-            logger.info(f"Retrieved {len(test_list)} tests for user_id={user_id}", extra={'request_id': request_id})
-            return {"tests": test_list}
+                return ORJSONResponse({"tests": []})
+            logger.info(f"Retrieved {len(tests)} tests for user_id={user_id}", extra={'request_id': request_id})
+            return ORJSONResponse({"tests": tests})
         except (aiomysql.OperationalError, aiomysql.IntegrityError) as e:
             raise await handle_db_error(e, request_id)
         except Exception as e:
@@ -132,38 +135,19 @@ async def get_my_tests(request: Request, cursor=Depends(get_db), user_id: int =
             raise HTTPException(status_code=500, detail="Internal server error")
 
 @tests_router.get("/tests/results", summary="Retrieve all test attempts by the current user",
-                           response_model=dict)
+                  response_class=ORJSONResponse, responses={200: {"model": TestResultListResponse}})
 async def get_user_test_results(request: Request, user_id: int = Depends(get_current_user), cursor=Depends(get_db)):
     request_id = request.state.request_id
-    logger.debug(f"Retrieving test results for user_id={user_id}", extra={'request_id': request_id})
+    logger.debug("Retrieving test results for user_id=%s", user_id, extra={'request_id': request_id})
 
     async with cursor:
         try:
-            await cursor.execute(
-                """
-                SELECT ta.test_id, t.title, ta.start_time, ta.end_time, ta.score
-                FROM test_attempts ta
-                JOIN tests t ON ta.test_id = t.id
-                WHERE ta.user_id = %s AND ta.end_time IS NOT NULL
-                ORDER BY ta.end_time DESC
-                """,
-                (user_id,)
-            )
-            attempts = await cursor.fetchall()
-
-            results = [
-                TestResultResponse(
-                    test_id=attempt['test_id'],
-                    test_title=attempt['title'],
-                    start_time=attempt['start_time'].isoformat(),
-                    end_time=attempt['end_time'].isoformat(),
-                    score=attempt['score']
-                ) for attempt in attempts
-            ]
+            await cursor.execute(_SQL_SELECT_USER_RESULTS, (user_id,))
+            results = await cursor.fetchall()
 
             logger.info(f"Retrieved {len(results)} test results for user_id={user_id}",
                         extra={'request_id': request_id})
-            return {"results": results}
+            return ORJSONResponse({"results": results})
         except (aiomysql.OperationalError, aiomysql.Error) as e:
             raise await handle_db_error(e, request_id)
         except Exception as e:
@@ -172,42 +156,42 @@ async def get_user_test_results(request: Request, user_id: int = Depends(get_cur
             raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@tests_router.get("/tests/{id}", summary="Retrieve test details", response_model=TestDetailResponse)
+@tests_router.get("/tests/{id}", summary="Retrieve test details", response_class=ORJSONResponse,
+                  responses={200: {"model": TestDetailResponse}})
 async def get_test(id: int, request: Request, user_id: int = Depends(get_current_user), cursor=Depends(get_db)):
     request_id = request.state.request_id
     lang = get_language(request)
-    logger.debug(f"Fetching test details: test_id={id}, user_id={user_id}", extra={'request_id': request_id})
+    logger.debug("Fetching test details: test_id=%s, user_id=%s", id, user_id, extra={'request_id': request_id})
 
     async with cursor:
         try:
             await check_creator_permission(cursor, user_id, test_id=id, lang=lang, request_id=request_id)
-            await cursor.execute("SELECT id, title, description, time_limit, shuffle_questions FROM tests WHERE id = %s", (id,))
-            test = await cursor.fetchone()
-            if not test:
+            await cursor.execute(_SQL_SELECT_TEST_WITH_QUESTIONS, (id,))
+            rows = await cursor.fetchall()
+            if not rows:
                 logger.warning(f"Test not found: test_id={id}", extra={'request_id': request_id})
                 raise HTTPException(status_code=404, detail=translate_message('test_not_found', lang))
 
-            await cursor.execute("SELECT id, text, type, options, correct_answer FROM questions WHERE test_id = %s", (id,))
-            questions = await cursor.fetchall()
+            test = rows[0]
             question_list = [
                 {
-                    "id": q['id'],
+                    "id": q['question_id'],
                     "text": q['text'],
                     "type": q['type'],
-                    "options": json.loads(q['options']) if q['options'] else None,
+                    "options": q['options'],
                     "correct_answer": q['correct_answer']
-                } for q in questions
+                } for q in rows if q['question_id'] is not None
             ]
 
-            logger.info(f"Test details retrieved: test_id={id}, title={test['title']}, questions_count={len(questions)}", extra={'request_id': request_id})
-            return TestDetailResponse(
-                id=test['id'],
-                title=test['title'],
-                description=test['description'],
-                time_limit=test['time_limit'],
-                shuffle_questions=test['shuffle_questions'],
-                questions=question_list
-            )
+            logger.info(f"Test details retrieved: test_id={id}, title={test['title']}, questions_count={len(question_list)}", extra={'request_id': request_id})
+            return ORJSONResponse({
+                "id": test['id'],
+                "title": test['title'],
+                "description": test['description'],
+                "time_limit": test['time_limit'],
+                "shuffle_questions": bool(test['shuffle_questions']),
+                "questions": question_list
+            })
         except HTTPException:
             raise
         except (aiomysql.OperationalError, aiomysql.IntegrityError) as e:
@@ -216,37 +200,35 @@ async def get_test(id: int, request: Request, user_id: int = Depends(get_current
             logger.error(f"Unexpected error retrieving test: {str(e)}", extra={'request_id': request_id}, exc_info=True)
             raise HTTPException(status_code=500, detail="Internal server error")
 
-@tests_router.post("/tests", summary="Create a new test")
-async def create_test(request: Request, data: TestRequest, user_id: int = Depends(get_current_user), cursor=Depends(get_db)):
+@tests_router.post("/tests", summary="Create a new test", openapi_extra=json_body_openapi(TestRequest))
+async def create_test(request: Request, user_id: int = Depends(get_current_user), data: TestRequest = Depends(json_body(TestRequest)), cursor=Depends(get_db)):
     request_id = request.state.request_id
     lang = get_language(request)
-    logger.debug(f"Creating test: title={data.title}, user_id={user_id}, questions_count={len(data.questions)}", extra={'request_id': request_id})
+    logger.debug("Creating test: title=%s, user_id=%s, questions_count=%s", data.title, user_id, len(data.questions), extra={'request_id': request_id})
 
     async with cursor:
         try:
             await check_creator_permission(cursor, user_id, lang=lang, request_id=request_id)
-            await cursor.execute("SELECT id FROM tests WHERE title = %s", (data.title,))
-            if await cursor.fetchone():
+            options_json = serialize_question_options(data.questions)
+
+            await cursor.connection.begin()
+            try:
+                await cursor.execute(
+                    _SQL_INSERT_TEST,
+                    (data.title, data.description, user_id, data.time_limit, data.shuffle_questions, len(data.questions))
+                )
+            except aiomysql.IntegrityError as e:
+                if e.args[0] != ER.DUP_ENTRY:
+                    raise
                 logger.warning(f"Test title already exists: {data.title}", extra={'request_id': request_id})
                 raise HTTPException(status_code=400, detail=translate_message('validation_error', lang))
-
-            await cursor.execute(
-                "INSERT INTO tests (title, description, creator_id, time_limit, shuffle_questions) "
-                "VALUES (%s, %s, %s, %s, %s)",
-                (data.title, data.description, user_id, data.time_limit, data.shuffle_questions)
-            )
             test_id = cursor.lastrowid
 
-            for q in data.questions:
-                options = q.get('options')
-                if options and not all(isinstance(opt, str) for opt in options):
-                    logger.warning(f"Invalid options format for test_id={test_id}", extra={'request_id': request_id})
-                    raise HTTPException(status_code=400, detail="Options must be a list of strings")
-                await cursor.execute(
-                    "INSERT INTO questions (test_id, text, type, options, correct_answer) "
-                    "VALUES (%s, %s, %s, %s, %s)",
-                    (test_id, q['text'], q['type'], json.dumps(options) if options else None, q.get('correct_answer'))
-                )
+            rows = [
+                (test_id, q.text, q.type, options, q.correct_answer, position)
+                for position, (q, options) in enumerate(zip(data.questions, options_json))
+            ]
+            await cursor.executemany(_SQL_INSERT_QUESTION, rows)
             await cursor.connection.commit()
             logger.info(f"Test created: test_id={test_id}, title={data.title}, creator_id={user_id}", extra={'request_id': request_id})
             return {'test_id': test_id, 'message': translate_message('test_created', lang)}
@@ -258,38 +240,54 @@ async def create_test(request: Request, data: TestRequest, user_id: int = Depend
             logger.error(f"Unexpected error creating test: {str(e)}", extra={'request_id': request_id}, exc_info=True)
             raise HTTPException(status_code=500, detail="Internal server error")
 
-@tests_router.patch("/tests/{id}", summary="Update an existing test")
-async def update_test(id: int, request: Request, data: TestRequest, user_id: int = Depends(get_current_user), cursor=Depends(get_db)):
+@tests_router.patch("/tests/{id}", summary="Update an existing test", openapi_extra=json_body_openapi(TestRequest))
+async def update_test(id: int, request: Request, user_id: int = Depends(get_current_user), data: TestRequest = Depends(json_body(TestRequest)), cursor=Depends(get_db)):
     request_id = request.state.request_id
     lang = get_language(request)
-    logger.debug(f"Updating test: test_id={id}, user_id={user_id}, title={data.title}, questions_count={len(data.questions)}", extra={'request_id': request_id})
+    logger.debug("Updating test: test_id=%s, user_id=%s, title=%s, questions_count=%s", id, user_id, data.title, len(data.questions), extra={'request_id': request_id})
 
     async with cursor:
         try:
             await check_creator_permission(cursor, user_id, test_id=id, lang=lang, request_id=request_id)
-            await cursor.execute("SELECT id FROM tests WHERE title = %s AND id != %s", (data.title, id))
-            if await cursor.fetchone():
+            options_json = serialize_question_options(data.questions)
+
+            await cursor.connection.begin()
+            try:
+                await cursor.execute(
+                    _SQL_UPDATE_TEST,
+                    (data.title, data.description, data.time_limit, data.shuffle_questions, len(data.questions), id)
+                )
+            except aiomysql.IntegrityError as e:
+                if e.args[0] != ER.DUP_ENTRY:
+                    raise
                 logger.warning(f"Test title already exists: {data.title}", extra={'request_id': request_id})
                 raise HTTPException(status_code=400, detail=translate_message('validation_error', lang))
 
-            await cursor.execute(
-                "UPDATE tests SET title = %s, description = %s, time_limit = %s, shuffle_questions = %s "
-                "WHERE id = %s",
-                (data.title, data.description, data.time_limit, data.shuffle_questions, id)
-            )
-            await cursor.execute("DELETE FROM questions WHERE test_id = %s", (id,))
+            await cursor.execute(_SQL_SELECT_QUESTIONS, (id,))
+            existing = {q['id']: q for q in await cursor.fetchall()}
 
-            for q in data.questions:
-                options = q.get('options')
-                if options and not all(isinstance(opt, str) for opt in options):
-                    logger.warning(f"Invalid options format for test_id={id}", extra={'request_id': request_id})
-                    raise HTTPException(status_code=400, detail="Options must be a list of strings")
-                await cursor.execute(
-                    "INSERT INTO questions (test_id, text, type, options, correct_answer) "
-                    "VALUES (%s, %s, %s, %s, %s)",
-                    (id, q['text'], q['type'], json.dumps(options) if options else None, q.get('correct_answer'))
-                )
+            # Questions are matched by the client-supplied id; only new, changed or moved rows are written so
+            # that answers referencing unchanged questions survive the update. New questions get id NULL.
+            # The request order is stored in position, so reordering existing questions rewrites their rows.
+            to_upsert, kept_ids = [], set()
+            for position, (q, options) in enumerate(zip(data.questions, options_json)):
+                current = existing.get(q.id) if q.id not in kept_ids else None
+                if current is not None:
+                    kept_ids.add(current['id'])
+                    if (current['text'], current['type'], current['options'], current['correct_answer'],
+                            current['position']) == \
+                            (q.text, q.type, q.options or None, q.correct_answer, position):
+                        continue
+                to_upsert.append((current['id'] if current else None, id, q.text, q.type,
+                                  options, q.correct_answer, position))
+            to_delete = tuple(existing.keys() - kept_ids)
+
+            if to_delete:
+                await cursor.execute(_SQL_DELETE_QUESTIONS_BY_ID, (id, to_delete))
+            await cursor.executemany(_SQL_UPSERT_QUESTION, to_upsert)
             await cursor.connection.commit()
+            logger.debug("Questions synced: test_id=%s, upserted=%s, deleted=%s", id, len(to_upsert), len(to_delete),
+                         extra={'request_id': request_id})
             logger.info(f"Test updated: test_id={id}, title={data.title}", extra={'request_id': request_id})
             return {'message': translate_message('test_updated', lang)}
         except HTTPException:
@@ -304,13 +302,13 @@ async def update_test(id: int, request: Request, data: TestRequest, user_id: int
 async def delete_test(id: int, request: Request, user_id: int = Depends(get_current_user), cursor=Depends(get_db)):
     request_id = request.state.request_id
     lang = get_language(request)
-    logger.debug(f"Deleting test: test_id={id}, user_id={user_id}", extra={'request_id': request_id})
+    logger.debug("Deleting test: test_id=%s, user_id=%s", id, user_id, extra={'request_id': request_id})
 
     async with cursor:
         try:
             await check_creator_permission(cursor, user_id, test_id=id, lang=lang, request_id=request_id)
-            await cursor.execute("DELETE FROM questions WHERE test_id = %s", (id,))
-            await cursor.execute("DELETE FROM tests WHERE id = %s", (id,))
+            await cursor.execute(_SQL_DELETE_QUESTIONS, (id,))
+            await cursor.execute(_SQL_DELETE_TEST, (id,))
             await cursor.connection.commit()
             logger.info(f"Test deleted: test_id={id}", extra={'request_id': request_id})
             return {'message': translate_message('test_deleted', lang)}
@@ -0,0 +1,35 @@
+from fastapi import Request, HTTPException, Depends
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import logging
+import jwt
+import os
+from dotenv import load_dotenv
+from utils import decode_access_token
+
+load_dotenv()
+JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
+if not JWT_SECRET_KEY:
+    raise ValueError("JWT_SECRET_KEY environment variable is not set")
+JWT_SECRET_KEY_BYTES = JWT_SECRET_KEY.encode('utf-8')
+
+logger = logging.getLogger('app.security')
+security = HTTPBearer(auto_error=False)
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), request: Request = None):
+    request_id = getattr(request.state, 'request_id', 'unknown') if request else 'unknown'
+    if not credentials or not credentials.credentials:
+        logger.error("Missing Authorization header", extra={'request_id': request_id})
+        raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
+
+    logger.debug("Decoding JWT token: %s...", credentials.credentials[:10], extra={'request_id': request_id})
+    try:
+        return decode_access_token(credentials.credentials, JWT_SECRET_KEY_BYTES)
+    except jwt.ExpiredSignatureError:
+        logger.error("JWT token expired", extra={'request_id': request_id})
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError as e:
+        logger.error(f"Invalid JWT token: {str(e)}", extra={'request_id': request_id})
+        raise HTTPException(status_code=401, detail="Invalid token")
+    except Exception as e:
+        logger.error(f"Unexpected error in JWT decoding: {str(e)}", extra={'request_id': request_id}, exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
@@ -1,45 +1,135 @@
 from fastapi import Request, HTTPException
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+from cachetools import TTLCache
+from functools import lru_cache
+import hashlib
 import logging
+import time
 import aiomysql
+import jwt
 
 logger = logging.getLogger('app.utils')
 
+# Verified tokens keyed by a digest of the raw token, so full tokens are never kept in memory
+_token_cache = TTLCache(maxsize=10_000, ttl=3600)
+_JWT_ALGORITHMS = ['HS256']
+# Roles never change after registration; the short TTL only bounds staleness if a user row is removed
+_role_cache = TTLCache(maxsize=10_000, ttl=60)
+
+_SQL_SELECT_ROLE = "SELECT role FROM users WHERE id = %s"
+_SQL_SELECT_TEST_OWNER = "SELECT creator_id FROM tests WHERE id = %s"
+_SQL_SELECT_ROLE_AND_OWNER = "SELECT u.role, t.creator_id FROM users u LEFT JOIN tests t ON t.id = %s WHERE u.id = %s"
+
+_TRANSLATIONS_RU = {
+    'user_registered': 'Пользователь успешно зарегистрирован',
+    'invalid_credentials': 'Неверные учетные данные',
+    'test_created': 'Тест успешно создан',
+    'test_updated': 'Тест успешно обновлен',
+    'test_deleted': 'Тест успешно удален',
+    'test_not_found': 'Тест не найден',
+    'no_permission': 'Нет прав',
+    'validation_error': 'Ошибка валидации',
+    'api_documentation': 'Документация API',
+    'user_not_found': 'Пользователь не найден'
+}
+_TRANSLATIONS_EN = {
+    'user_registered': 'User registered successfully',
+    'invalid_credentials': 'Invalid credentials',
+    'test_created': 'Test created successfully',
+    'test_updated': 'Test updated successfully',
+    'test_deleted': 'Test deleted successfully',
+    'test_not_found': 'Test not found',
+    'no_permission': 'No permission',
+    'validation_error': 'Validation error',
+    'api_documentation': 'API documentation',
+    'user_not_found': 'User not found'
+}
+# Canonical language strings shared with the translation keys, so lookups on a decoded
+# header value compare by identity. Untrusted header values are deliberately not interned.
+_LANGUAGES = {lang: lang for lang in ('ru', 'en')}
+# Flat (lang, message) table so the common case is a single lookup
+_TRANSLATIONS = {
+    (lang, message): text
+    for lang, table in (('ru', _TRANSLATIONS_RU), ('en', _TRANSLATIONS_EN))
+    for message, text in table.items()
+}
+
 def get_language(request: Request) -> str:
-    lang = request.headers.get('accept-language', 'ru').split(',')[0]
-    logger.debug(f"Extracted language from request: {lang}", extra={'request_id': getattr(request.state, 'request_id', 'unknown')})
+    lang = getattr(request.state, 'lang', None)
+    if lang is not None:
+        return lang
+
+    # Scan the raw ASGI headers instead of building Starlette's Headers wrapper
+    for name, value in request.scope['headers']:
+        if name == b'accept-language':
+            lang = value.partition(b',')[0].decode('latin-1')
+            lang = _LANGUAGES.get(lang, lang)
+            break
+    else:
+        lang = 'ru'
+    request.state.lang = lang
+    logger.debug("Extracted language from request: %s", lang, extra={'request_id': getattr(request.state, 'request_id', 'unknown')})
     return lang
 
+@lru_cache(maxsize=512)
 def translate_message(message: str, lang: str) -> str:
-    logger.debug(f"Translating message: {message} for language: {lang}", extra={'request_id': 'unknown'})
-    translations = {
-        'ru': {
-            'user_registered': 'Пользователь успешно зарегистрирован',
-            'invalid_credentials': 'Неверные учетные данные',
-            'test_created': 'Тест успешно создан',
-            'test_updated': 'Тест успешно обновлен',
-            'test_deleted': 'Тест успешно удален',
-            'test_not_found': 'Тест не найден',
-            'no_permission': 'Нет прав',
-            'validation_error': 'Ошибка валидации',
-            'api_documentation': 'Документация API',
-            'user_not_found': 'Пользователь не найден'
-        },
-        'en': {
-            'user_registered': 'User registered successfully',
-            'invalid_credentials': 'Invalid credentials',
-            'test_created': 'Test created successfully',
-            'test_updated': 'Test updated successfully',
-            'test_deleted': 'Test deleted successfully',
-            'test_not_found': 'Test not found',
-            'no_permission': 'No permission',
-            'validation_error': 'Validation error',
-            'api_documentation': 'API documentation',
-            'user_not_found': 'User not found'
-        }
-    }
-    translated = translations.get(lang, translations['ru']).get(message, message)
-    logger.debug(f"Translated message: {translated}")
-    return translated
+    return _TRANSLATIONS.get((lang, message)) or _TRANSLATIONS.get(('ru', message), message)
+
+def decode_access_token(token: str, secret: bytes):
+    key = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+    cached = _token_cache.get(key)
+    if cached is not None:
+        user_id, exp = cached
+        if exp > time.time():
+            return user_id
+        _token_cache.pop(key, None)
+
+    payload = jwt.decode(token, secret, algorithms=_JWT_ALGORITHMS)
+    if 'exp' in payload:
+        _token_cache[key] = (payload['sub'], payload['exp'])
+    return payload['sub']
+
+def _is_json_content_type(content_type: str | None) -> bool:
+    # Same rule as FastAPI's own body parsing: no header, application/json or application/*+json
+    if not content_type:
+        return True
+    maintype, _, subtype = content_type.partition(';')[0].strip().lower().partition('/')
+    return maintype == 'application' and (subtype == 'json' or subtype.endswith('+json'))
+
+def json_body(model: type[BaseModel]):
+    """Dependency that parses and validates the raw request body in a single pydantic-core pass."""
+    async def dependency(request: Request):
+        if not _is_json_content_type(request.headers.get('content-type')):
+            raise RequestValidationError([{
+                'type': 'model_attributes_type',
+                'loc': ('body',),
+                'msg': 'Input should be a valid dictionary or object to extract fields from',
+                'input': None
+            }])
+        try:
+            return model.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError(
+                [{**err, 'loc': ('body', *err['loc'])} for err in e.errors(include_url=False)]
+            )
+    return dependency
+
+def json_body_openapi(model: type[BaseModel]) -> dict:
+    """OpenAPI requestBody for routes that read their body through json_body()."""
+    schema = model.model_json_schema()
+    defs = schema.pop('$defs', {})
+
+    def inline(node):
+        if isinstance(node, dict):
+            if '$ref' in node:
+                return inline(defs[node['$ref'].rsplit('/', 1)[1]])
+            return {k: inline(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [inline(v) for v in node]
+        return node
+
+    return {'requestBody': {'required': True, 'content': {'application/json': {'schema': inline(schema)}}}}
 
 async def handle_db_error(e: Exception, request_id: str = 'unknown') -> HTTPException:
     logger.error(f"Database error: {str(e)}", extra={'request_id': request_id}, exc_info=True)
@@ -50,33 +140,48 @@ async def handle_db_error(e: Exception, request_id: str = 'unknown') -> HTTPExce
     return HTTPException(status_code=500, detail="Internal database error")
 
 async def check_creator_permission(cursor, user_id: int, test_id: int | None = None, lang: str = 'ru', request_id: str = 'unknown'):
-    logger.debug(f"Checking creator permission for user_id={user_id}, test_id={test_id}", extra={'request_id': request_id})
+    logger.debug("Checking creator permission for user_id=%s, test_id=%s", user_id, test_id, extra={'request_id': request_id})
     try:
-        await cursor.execute("SELECT role FROM users WHERE id = %s", (user_id,))
-        user = await cursor.fetchone()
+        role = _role_cache.get(user_id)
+        owner_id = None
+        if role is None:
+            # Role and test ownership come back in one round trip
+            if test_id:
+                await cursor.execute(_SQL_SELECT_ROLE_AND_OWNER, (test_id, user_id))
+            else:
+                await cursor.execute(_SQL_SELECT_ROLE, (user_id,))
+            user = await cursor.fetchone()
+            if user:
+                role = _role_cache[user_id] = user['role']
+                owner_id = user.get('creator_id')
+        elif test_id and role == 'creator':
+            await cursor.execute(_SQL_SELECT_TEST_OWNER, (test_id,))
+            test = await cursor.fetchone()
+            owner_id = test['creator_id'] if test else None
 
-        if not user or user['role'] != 'creator':
+        if role != 'creator':
             logger.warning(f"No permission: User ID={user_id} is not a creator", extra={'request_id': request_id})
             raise HTTPException(status_code=403, detail=translate_message('no_permission', lang))
 
-        if test_id:
-            await cursor.execute("SELECT creator_id FROM tests WHERE id = %s", (test_id,))
-            test = await cursor.fetchone()
-
-            if not test or test['creator_id'] != user_id:
-                logger.warning(f"Test not found or not owned by user ID={user_id}, Test ID={test_id}", extra={'request_id': request_id})
-                raise HTTPException(status_code=404, detail=translate_message('test_not_found', lang))
+        # owner_id is None when the test does not exist
+        if test_id and owner_id != user_id:
+            logger.warning(f"Test not found or not owned by user ID={user_id}, Test ID={test_id}", extra={'request_id': request_id})
+            raise HTTPException(status_code=404, detail=translate_message('test_not_found', lang))
     except Exception as e:
         logger.error(f"Error checking creator permission: {str(e)}", extra={'request_id': request_id}, exc_info=True)
         raise
 
 async def check_participant_permission(cursor, user_id: int, lang: str, request_id: str = 'unknown'):
-    logger.debug(f"Checking participant permission for user_id={user_id}", extra={'request_id': request_id})
+    logger.debug("Checking participant permission for user_id=%s", user_id, extra={'request_id': request_id})
     try:
-        await cursor.execute("SELECT role FROM users WHERE id = %s", (user_id,))
-        user = await cursor.fetchone()
+        role = _role_cache.get(user_id)
+        if role is None:
+            await cursor.execute(_SQL_SELECT_ROLE, (user_id,))
+            user = await cursor.fetchone()
+            if user:
+                role = _role_cache[user_id] = user['role']
 
-        if not user or user['role'] != 'participant':
+        if role != 'participant':
             logger.warning(f"No permission: User ID={user_id} is not a participant", extra={'request_id': request_id})
             raise HTTPException(status_code=403, detail=translate_message('no_permission', lang))
     except Exception as e: